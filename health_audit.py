@@ -0,0 +1,369 @@
+"""
+Health audit for the Airbnb Seattle dataset, extracted from WSB-DSS.ipynb so the
+API can call it directly instead of re-executing notebook cells.
+
+Typical use:
+    audit = run_health_audit_files()          # or run_health_audit(listings, calendar, reviews)
+    persist_health_audit(audit, overwrite=True)
+"""
+import json, hashlib, datetime as dt
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+# ---------- Config ----------
+DB_PATH  = Path("wsb_dss.duckdb")
+DATA_DIR = Path("data/airbnb_seattle")
+
+DATASET_FILES = {
+    'listings': DATA_DIR / 'listings.csv',
+    'calendar': DATA_DIR / 'calendar.csv',
+    'reviews' : DATA_DIR / 'reviews.csv'
+}
+
+# Types DuckDB's CSV sniffer may pick. BOOLEAN is left out so 't'/'f' columns
+# (calendar.available, host_is_superhost, instant_bookable, ...) keep their raw values.
+CSV_TYPE_CANDIDATES = ['BIGINT', 'DOUBLE', 'DATE', 'TIMESTAMP', 'VARCHAR']
+# Same strings pandas.read_csv treats as missing, so missingness metrics don't shift
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+                 '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+# Short hash of the reader options above; part of the Parquet cache file name, so
+# changing them makes the cached copies stale even when the CSVs haven't changed.
+CSV_OPTIONS_TAG = hashlib.sha1(repr((CSV_TYPE_CANDIDATES, CSV_NA_VALUES)).encode()).hexdigest()[:8]
+
+def _read_csv(con, csv_path: Path):
+    return con.read_csv(str(csv_path), auto_type_candidates=CSV_TYPE_CANDIDATES, na_values=CSV_NA_VALUES)
+
+# ---------- Data load ----------
+def _ensure_parquet(con, csv_path: Path):
+    """
+    Return a ZSTD Parquet copy of csv_path (written next to it), converting the
+    CSV with DuckDB only when the copy for the current reader options is missing
+    or older than the CSV. Copies made with other options are removed.
+    Falls back to the CSV itself if the copy can't be written.
+    """
+    pq = csv_path.with_name(f"{csv_path.stem}.{CSV_OPTIONS_TAG}.parquet")
+    if pq.exists() and pq.stat().st_mtime_ns >= csv_path.stat().st_mtime_ns:
+        return pq
+    tmp = pq.with_suffix('.parquet.tmp')
+    try:
+        _read_csv(con, csv_path).to_parquet(str(tmp), compression='zstd')
+        tmp.replace(pq)
+    except (OSError, duckdb.Error) as e:
+        print(f"[load] Could not cache {csv_path.name} as Parquet ({e}); reading the CSV.")
+        tmp.unlink(missing_ok=True)
+        return csv_path
+    for stale in csv_path.parent.glob(f"{csv_path.stem}*.parquet"):
+        if stale != pq:
+            stale.unlink(missing_ok=True)
+    return pq
+
+def _pandas_dtypes(df):
+    """
+    Match the dtypes pd.read_csv would give: integer columns with gaps become
+    float64 (DuckDB returns nullable Int64) and all-empty columns become float64.
+    """
+    for col in df.columns:
+        s = df[col]
+        if s.isna().all():
+            df[col] = s.astype('float64')
+        elif pd.api.types.is_integer_dtype(s.dtype) and pd.api.types.is_extension_array_dtype(s.dtype):
+            df[col] = s.astype('float64') if s.isna().any() else s.astype('int64')
+    return df
+
+def load_datasets(files=DATASET_FILES):
+    """
+    Load listings, calendar and reviews with DuckDB (CSV on first use, the cached
+    Parquet copy afterwards) and return them as pandas DataFrames with parsed dates.
+    """
+    con = duckdb.connect()
+    frames = {}
+    for name, path in files.items():
+        src = _ensure_parquet(con, Path(path))
+        rel = con.read_parquet(str(src)) if src.suffix == '.parquet' else _read_csv(con, src)
+        frames[name] = _pandas_dtypes(rel.df())
+    con.close()
+    listings, calendar, reviews = frames['listings'], frames['calendar'], frames['reviews']
+
+    # DuckDB already types clean date columns; this only catches ones it left as text
+    for col in ['host_since', 'first_review', 'last_review', 'calendar_last_scraped', 'last_scraped']:
+        if col in listings.columns:
+            listings[col] = pd.to_datetime(listings[col], errors='coerce')
+    if 'date' in calendar.columns:
+        calendar['date'] = pd.to_datetime(calendar['date'], errors='coerce')
+    if 'date' in reviews.columns:
+        reviews['date'] = pd.to_datetime(reviews['date'], errors='coerce')
+
+    return listings, calendar, reviews
+
+# ---------- DB helpers ----------
+def _con():
+    return duckdb.connect(str(DB_PATH))
+
+# Create the two singleton audit tables (1 row per dataset_id)
+def ensure_audit_tables(con=None):
+    con = con or _con()
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS health_checks (
+            dataset_id TEXT PRIMARY KEY,
+            computed_at TIMESTAMP,
+            metrics TEXT            -- JSON
+        );
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS deep_dive_checks (
+            dataset_id TEXT PRIMARY KEY,
+            computed_at TIMESTAMP,
+            metrics TEXT            -- JSON
+        );
+    """)
+    # Auxiliary tables for detailed frames (we replace them entirely on persist)
+    # We store one copy per dataset in each table via a dataset_id column.
+    # Tables are created on first persist.
+
+def _df_to_table(con, df: pd.DataFrame, table_name: str, dataset_id: str):
+    df = df.copy()
+    df.insert(0, "dataset_id", dataset_id)
+    con.execute(f"CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM df LIMIT 0")
+    # Replace the whole table for this dataset_id
+    con.execute(f"DELETE FROM {table_name} WHERE dataset_id = ?", [dataset_id])
+    con.register("df", df)
+    con.execute(f"INSERT INTO {table_name} SELECT * FROM df")
+    con.unregister("df")
+
+def persist_health_audit(audit: dict, dataset_id="airbnb_seattle", overwrite=False, verbose=True, con=None):
+    """
+    audit: dict from run_health_audit(...): {'metrics': {...}, 'tables': {...}}
+    Writes a single row to health_checks; stores detailed frames in *_health_* tables.
+    con: optional open DuckDB connection to reuse (defaults to a new one on DB_PATH).
+    """
+    con = con or _con()
+    ensure_audit_tables(con)
+    # skip if exists and not overwriting
+    exists = con.execute("SELECT 1 FROM health_checks WHERE dataset_id=?", [dataset_id]).fetchone() is not None
+    if exists and not overwrite:
+        if verbose: print(f"[health_checks] Row already exists for dataset_id='{dataset_id}'. Skipping (overwrite=False).")
+        return
+
+    # upsert the JSON metrics row
+    con.execute("DELETE FROM health_checks WHERE dataset_id=?", [dataset_id])
+    con.execute(
+        "INSERT INTO health_checks VALUES (?,?,?)",
+        [dataset_id, dt.datetime.now(), json.dumps(audit.get("metrics", {}))]
+    )
+
+    # store detailed tables (replace per dataset_id)
+    tbls = audit.get("tables", {})
+    if isinstance(tbls.get("missing_listings"), pd.DataFrame):
+        _df_to_table(con, tbls["missing_listings"], "detail_health_missing_listings", dataset_id)
+    if isinstance(tbls.get("missing_calendar"), pd.DataFrame):
+        _df_to_table(con, tbls["missing_calendar"], "detail_health_missing_calendar", dataset_id)
+    if isinstance(tbls.get("missing_reviews"), pd.DataFrame):
+        _df_to_table(con, tbls["missing_reviews"], "detail_health_missing_reviews", dataset_id)
+    if isinstance(tbls.get("bad_avail_examples"), pd.DataFrame):
+        _df_to_table(con, tbls["bad_avail_examples"], "detail_health_bad_availability", dataset_id)
+    if isinstance(tbls.get("rev_consistency_sample"), pd.DataFrame):
+        _df_to_table(con, tbls["rev_consistency_sample"], "detail_health_review_consistency", dataset_id)
+    if isinstance(tbls.get("price_summaries"), pd.DataFrame):
+        _df_to_table(con, tbls["price_summaries"], "detail_health_price_summaries", dataset_id)
+
+    if verbose: print(f"[health_checks] Persisted for dataset_id='{dataset_id}'.")
+
+# ---------- Health audit ----------
+# Computed with SQL in an in-memory DuckDB connection over three views (listings,
+# calendar, reviews). The views sit either on the cached Parquet files
+# (run_health_audit_files) or on caller-supplied DataFrames (run_health_audit).
+
+LISTINGS_DATE_COLS = ['host_since', 'first_review', 'last_review', 'calendar_last_scraped', 'last_scraped']
+
+def _q(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _columns(con, view):
+    return {name: dtype for name, dtype in con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {view})").fetchall()}
+
+def _is_temporal(dtype):
+    return dtype.startswith(('DATE', 'TIMESTAMP'))
+
+def _money_to_float(col, dtype):
+    if dtype in ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'FLOAT', 'DOUBLE') or dtype.startswith('DECIMAL'):
+        return f"{col}::DOUBLE"
+    return f"TRY_CAST(NULLIF(NULLIF(regexp_replace({col}::VARCHAR, '[^0-9.\\-]', '', 'g'), ''), '.') AS DOUBLE)"
+
+def _create_audit_views(con):
+    """
+    Build listings/calendar/reviews views over the *_raw relations, adding the
+    derived price_num / available_norm columns and parsing text date columns.
+    """
+    date_cols = {'listings': LISTINGS_DATE_COLS, 'calendar': ['date'], 'reviews': ['date']}
+    for name in ('listings', 'calendar', 'reviews'):
+        cols = _columns(con, f"{name}_raw")
+        replace = [f"TRY_CAST({_q(c)} AS TIMESTAMP) AS {_q(c)}"
+                   for c in date_cols[name] if c in cols and not _is_temporal(cols[c])]
+        extra = []
+        if name in ('listings', 'calendar') and 'price' in cols and 'price_num' not in cols:
+            extra.append(f"{_money_to_float('price', cols['price'])} AS price_num")
+        if name == 'calendar' and 'available' in cols:
+            extra.append("coalesce(lower(trim(available::VARCHAR)), 'nan') AS available_norm")
+        star = f"* REPLACE ({', '.join(replace)})" if replace else "*"
+        con.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT {', '.join([star] + extra)} FROM {name}_raw")
+
+def _missing_pct(con, view):
+    """
+    Missing % per column, highest first. The fractions are put back in column
+    order and sorted with pandas before rounding, as isna().mean().sort_values()
+    does, so ties come out in the same order as the notebook's version.
+    """
+    df = con.execute(f"""
+        UNPIVOT (SELECT 1 - count(COLUMNS(*)) / count(*) FROM {view})
+        ON COLUMNS(*) INTO NAME column_name VALUE missing
+    """).df()
+    missing = df.set_index('column_name')['missing'].reindex(list(_columns(con, view))).rename_axis(None)
+    return missing.sort_values(ascending=False).to_frame("missing_pct").mul(100).round(2)
+
+def _health_audit_sql(con, verbose=True, progress=None):
+    progress = progress or (lambda stage: None)
+    L, C, R = (_columns(con, v) for v in ('listings', 'calendar', 'reviews'))
+    has_pair = {'listing_id', 'date'}.issubset(C)
+    rev_subset = [c for c in ['listing_id', 'date', 'reviewer_id', 'id'] if c in R]
+    has_comp = {'listing_id', 'date'}.issubset(R) and {'id', 'first_review', 'last_review'}.issubset(L)
+
+    def dups(view, cols):
+        keys = ', '.join(_q(c) for c in cols)
+        return f"(SELECT count(*) FROM {view}) - (SELECT count(*) FROM (SELECT DISTINCT {keys} FROM {view}))"
+
+    def not_in_listings(view):
+        if 'listing_id' not in (C if view == 'calendar' else R) or 'id' not in L:
+            return "NULL"
+        return f"(SELECT count(*) FROM {view} v ANTI JOIN listings l ON v.listing_id = l.id)"
+
+    def date_range(view, cols, col):
+        if col not in cols or not _is_temporal(cols[col]):
+            return "[NULL, NULL]"
+        fmt = "'%Y-%m-%d %H:%M:%S'"
+        return (f"(SELECT [strftime(min({_q(col)})::TIMESTAMP, {fmt}), "
+                f"strftime(max({_q(col)})::TIMESTAMP, {fmt})] FROM {view})")
+
+    # row_num is the listing's position in the file, so the sample can follow file order
+    comp_cte = """
+        WITH rev_span AS (SELECT listing_id, min(date) AS rev_min, max(date) AS rev_max
+                          FROM reviews WHERE listing_id IS NOT NULL GROUP BY listing_id),
+             l AS (SELECT id, first_review, last_review, row_number() OVER () AS row_num FROM listings)
+        SELECT l.row_num, l.id, l.first_review, l.last_review, s.rev_min, s.rev_max
+        FROM l LEFT JOIN rev_span s ON l.id = s.listing_id
+    """
+    if has_comp:
+        mismatch = f"""(SELECT json_object(
+            'first_review_mismatch', count(*) FILTER (first_review IS NOT NULL AND rev_min IS NOT NULL AND first_review <> rev_min),
+            'last_review_mismatch',  count(*) FILTER (last_review IS NOT NULL AND rev_max IS NOT NULL AND last_review <> rev_max))
+            FROM ({comp_cte}))"""
+    else:
+        mismatch = "json_object('first_review_mismatch', NULL, 'last_review_mismatch', NULL)"
+
+    avail = ("(SELECT json_group_object(available_norm, n) FROM "
+             "(SELECT available_norm, count(*) AS n FROM calendar GROUP BY ALL ORDER BY n DESC))"
+             if 'available_norm' in C else "NULL")
+
+    date_ranges = [("listings." + c, date_range('listings', L, c)) for c in LISTINGS_DATE_COLS]
+    date_ranges += [("calendar.date", date_range('calendar', C, 'date')), ("reviews.date", date_range('reviews', R, 'date'))]
+
+    # one query for every metric, returned as a single JSON document
+    metrics_json = con.execute(f"""
+        SELECT json_object(
+            'rows_cols', json_object(
+                'listings_rows', (SELECT count(*) FROM listings), 'listings_cols', {len(L)},
+                'calendar_rows', (SELECT count(*) FROM calendar), 'calendar_cols', {len(C)},
+                'reviews_rows',  (SELECT count(*) FROM reviews),  'reviews_cols',  {len(R)}),
+            'duplicates', json_object(
+                'listings_id',   {dups('listings', ['id']) if 'id' in L else 'NULL'},
+                'calendar_pair', {dups('calendar', ['listing_id', 'date']) if has_pair else 'NULL'},
+                'reviews_keyed', {dups('reviews', rev_subset) if len(rev_subset) >= 2 else 'NULL'}),
+            'referential', json_object(
+                'calendar_not_in_listings', {not_in_listings('calendar')},
+                'reviews_not_in_listings',  {not_in_listings('reviews')}),
+            'date_ranges', json_object({', '.join(f"'{k}', {v}" for k, v in date_ranges)}),
+            'review_mismatch_counts', {mismatch},
+            'availability_counts', {avail}
+        )
+    """).fetchone()[0]
+    metrics = json.loads(metrics_json)
+    progress("metrics")
+
+    # price summaries (linear-interpolated quantiles, as pandas .quantile does)
+    def price_summary(view, cols, source):
+        if 'price_num' not in cols:
+            return f"SELECT '{source}' AS source, 0 AS N"
+        return f"""
+            SELECT '{source}' AS source, count(price_num) AS N, min(price_num) AS min,
+                   quantile_cont(price_num, 0.01) AS p1, quantile_cont(price_num, 0.05) AS p5,
+                   quantile_cont(price_num, 0.5) AS median, quantile_cont(price_num, 0.95) AS p95,
+                   quantile_cont(price_num, 0.99) AS p99, max(price_num) AS max,
+                   count(*) FILTER (price_num = 0) AS zeros, count(*) FILTER (price_num < 0) AS negatives
+            FROM {view}
+        """
+    price_summ = pd.DataFrame([
+        row for sql in (price_summary('listings', L, 'listings.price_num'), price_summary('calendar', C, 'calendar.price_num'))
+        for row in con.execute(sql).df().to_dict('records')
+    ])
+
+    bad_avail_examples = pd.DataFrame()
+    if 'available_norm' in C:
+        bad = con.execute("""
+            SELECT listing_id, date, available FROM calendar
+            WHERE available_norm NOT IN ('t', 'f') LIMIT 100
+        """).df()
+        if not bad.empty:
+            bad_avail_examples = bad
+
+    rev_sample = pd.DataFrame()
+    if has_comp:
+        rev_sample = con.execute(f"SELECT * EXCLUDE (row_num) FROM ({comp_cte}) ORDER BY row_num LIMIT 50").df().set_index('id')
+
+    tables = {
+        "missing_listings": _missing_pct(con, 'listings'),
+        "missing_calendar": _missing_pct(con, 'calendar'),
+        "missing_reviews":  _missing_pct(con, 'reviews'),
+        "bad_avail_examples": bad_avail_examples,
+        "rev_consistency_sample": rev_sample,
+        "price_summaries": price_summ,
+    }
+    progress("tables")
+
+    if verbose:
+        print("[Health] rows/cols:", metrics["rows_cols"])
+        print("[Health] duplicates:", metrics["duplicates"])
+        print("[Health] referential:", metrics["referential"])
+        print("[Health] availability counts:", metrics["availability_counts"])
+
+    return {"metrics": metrics, "tables": tables}
+
+def run_health_audit(listings: pd.DataFrame, calendar: pd.DataFrame, reviews: pd.DataFrame, verbose=True):
+    """Health audit over in-memory DataFrames (e.g. from the notebook). Returns {'metrics':..., 'tables':...}."""
+    con = duckdb.connect()
+    try:
+        for name, df in (('listings', listings), ('calendar', calendar), ('reviews', reviews)):
+            con.register(f"{name}_raw", df)
+        _create_audit_views(con)
+        return _health_audit_sql(con, verbose=verbose)
+    finally:
+        con.close()
+
+def run_health_audit_files(files=DATASET_FILES, verbose=True, progress=None):
+    """
+    Health audit straight from the source files (via their Parquet copies), without
+    loading them into pandas. Returns {'metrics':..., 'tables':...}.
+    progress: optional callable, called with a stage name ('files', 'metrics',
+    'tables') as each step finishes.
+    """
+    con = duckdb.connect()
+    try:
+        for name, path in files.items():
+            src = _ensure_parquet(con, Path(path))
+            rel = con.read_parquet(str(src)) if src.suffix == '.parquet' else _read_csv(con, src)
+            rel.create_view(f"{name}_raw")
+        _create_audit_views(con)
+        if progress: progress("files")
+        return _health_audit_sql(con, verbose=verbose, progress=progress)
+    finally:
+        con.close()